@@ -1,3 +1,5 @@
+import sys
+
 from .abprune import Node, ab_start
 
 
@@ -10,12 +12,8 @@ def main() -> None:
         ]
     )
 
-    print("=====MAX=====")
-    print()
-    ab_start(tree, is_max=True)
-    print()
-
-    print("=====MIN=====")
-    print()
-    ab_start(tree, is_max=False)
-    print()
+    for is_max in (True, False):
+        trace: list[str] = ["=====MAX=====" if is_max else "=====MIN=====", ""]
+        ab_start(tree, is_max=is_max, trace=trace)
+        trace.extend(("", ""))
+        sys.stdout.write("\n".join(trace))
@@ -1,27 +1,90 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import math
 
+INF = math.inf
+NEG_INF = -math.inf
+
+# transposition table flags: is a stored value exact, or only a bound on the true value?
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
 
 @dataclass(frozen=True, slots=True)
 class Node:
     is_leaf: bool
     value: float
-    children: list["Node"]
+    children: tuple["Node", ...]
+
+    # hashing would otherwise walk the whole subtree every time
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(
+            self, "_hash", hash((self.is_leaf, self.value, self.children))
+        )
+
+    def __hash__(self) -> int:
+        return self._hash
 
     @classmethod
     def from_lists(cls, l: list | float):
-        if isinstance(l, list):
-            # branch
-            return Node(
-                is_leaf=False, value=0, children=[Node.from_lists(c) for c in l]
-            )
-        else:
-            # leaf
-            return Node(is_leaf=True, value=l, children=[])
+        """
+        Builds a tree from nested lists, with numbers as leaves.
 
+        Equal sub-lists come out as the very same Node, so comparing them
+        (as the caches in `alphabeta_core` do) stops at an identity check
+        instead of walking both subtrees.
+        """
+        # also keyed by the value's type, so 1 and 1.0 still print as given
+        interned: dict[tuple[Node, type], Node] = {}
+
+        def build(l: list | float) -> Node:
+            if isinstance(l, list):
+                # branch
+                node = Node(
+                    is_leaf=False, value=0, children=tuple(build(c) for c in l)
+                )
+            else:
+                # leaf
+                node = Node(is_leaf=True, value=l, children=())
+            return interned.setdefault((node, type(node.value)), node)
+
+        return build(l)
 
-def inprint(depth: int, text: str):
-    print(f"{'⋅   ' * depth}{text}")
+
+def _heuristic(node: Node, is_max: bool) -> float:
+    """
+    Cheap one-ply estimate of a node's value, looking only at its leaf children.
+
+    Nodes with no leaf children get the best possible value for the player to move,
+    which is the worst for the player one ply up, so `_order` tries them last.
+    """
+    if node.is_leaf:
+        return node.value
+    leaves = [c.value for c in node.children if c.is_leaf]
+    if not leaves:
+        return INF if is_max else NEG_INF
+    return max(leaves) if is_max else min(leaves)
+
+
+def _order(node: Node, is_max: bool) -> tuple[Node, ...]:
+    """Children of a node, most promising first for the player to move."""
+    if all(c.is_leaf for c in node.children):
+        # looking at a leaf is as cheap as scoring it, so sorting can't pay off
+        return node.children
+    # the children are one ply down, so they are scored for the other player
+    return tuple(
+        sorted(
+            node.children,
+            key=lambda c: _heuristic(c, not is_max),
+            reverse=is_max,
+        )
+    )
+
+
+def indented(depth: int, text: str) -> str:
+    return f"{'⋅   ' * depth}{text}"
 
 
 def pname(is_max: bool):
@@ -29,62 +92,219 @@ def pname(is_max: bool):
 
 
 def pnum(x: float) -> str:
-    if math.isinf(x):
-        return "+∞" if x > 0 else "-∞"
+    return "+∞" if x == INF else "-∞" if x == NEG_INF else f"{x:+}"
+
+
+def alphabeta_core(
+    alpha: float,
+    beta: float,
+    node: Node,
+    is_max: bool,
+    orders: dict[tuple[Node, bool], tuple[Node, ...]] | None = None,
+    tt: dict[tuple[Node, bool], tuple[float, int]] | None = None,
+) -> float:
+    """
+    Alpha-beta search without any tracing; this is the one to use for real trees.
+
+    Children are tried in insertion order, unless an `orders` dict is passed in:
+    then they are tried in move order (see `_order`), with each ordering worked out
+    once and kept in `orders`, so it can be shared between searches of the same tree.
+    Ordering only pays off on trees where leaf values say something about their parents.
+
+    If a transposition table `tt` is passed in, results are kept in it as a value and
+    whether it is `EXACT` or only a `LOWER`/`UPPER` bound, so subtrees which appear more
+    than once only get searched again if the stored bound isn't good enough.
+    Pass `tt={}` for trees with many repeated subtrees (such as those from
+    `Node.from_lists`, which shares equal sub-lists) or when searching the same tree
+    again; on trees without repeats the probes and stores only slow the search down.
+    Both are keyed by the node itself, so identical subtrees count as the same
+    even if they were built separately.
+    """
+    if node.is_leaf:
+        return node.value
+
+    if tt is not None:
+        entry = tt.get((node, is_max))
+        if entry is not None:
+            v, flag = entry
+            if (
+                flag == EXACT
+                or (flag == LOWER and v >= beta)
+                or (flag == UPPER and v <= alpha)
+            ):
+                return v
 
-    if x > 0:
-        return f"+{x}"
+    children: tuple[Node, ...] | None
+    if orders is None:
+        children = node.children
     else:
-        return f"{x}"
+        children = orders.get((node, is_max))
+        if children is None:
+            children = orders[node, is_max] = _order(node, is_max)
 
+    # window this node was searched with, for working out what the result means
+    alpha_0 = alpha
+    beta_0 = beta
 
-def alphabeta(alpha: float, beta: float, node: Node, depth: int, is_max: bool):
+    value: float
+
+    if is_max:
+        value = NEG_INF
+        for child in children:
+            v = alphabeta_core(alpha, beta, child, False, orders, tt)
+            if v > value:  # noqa: PLR1730 - a compare is quicker than calling max()
+                value = v
+            if value >= beta:
+                break  # value still returned, potentially allowing bigger prunes above!
+            if value > alpha:  # noqa: PLR1730 - as above
+                alpha = value  # feed value back into rest of search
+
+    else:
+        value = INF
+        for child in children:
+            v = alphabeta_core(alpha, beta, child, True, orders, tt)
+            if v < value:  # noqa: PLR1730 - a compare is quicker than calling min()
+                value = v
+            if value <= alpha:
+                break  # value still returned, potentially allowing bigger prunes above!
+            if value < beta:  # noqa: PLR1730 - as above
+                beta = value  # feed value back into rest of search
+
+    if tt is not None:
+        if value <= alpha_0:
+            tt[node, is_max] = (value, UPPER)
+        elif value >= beta_0:
+            tt[node, is_max] = (value, LOWER)
+        else:
+            tt[node, is_max] = (value, EXACT)
+    return value
+
+
+def alphabeta_iter(alpha: float, beta: float, node: Node, is_max: bool) -> float:
+    """
+    Alpha-beta search that uses an explicit stack instead of recursion,
+    so there is no limit on the depth of the tree. It is slower than `alphabeta_core`,
+    so `ab_start` only falls back on it when a tree is too deep to search recursively.
+    """
     if node.is_leaf:
-        inprint(depth, f"hit leaf {pnum(node.value)}")
         return node.value
 
+    # each frame is [children, next child, alpha, beta, best so far, is_max]
+    stack: list[list] = [
+        [node.children, 0, alpha, beta, NEG_INF if is_max else INF, is_max]
+    ]
     value: float
 
-    inprint(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]")
+    while True:
+        frame = stack[-1]
+        children, i, a, b, best, mx = frame
+
+        if i == len(children):
+            # all children done (or pruned); hand the result up to the parent
+            stack.pop()
+            if not stack:
+                return best
+            value = best
+            frame = stack[-1]
+            children, i, a, b, best, mx = frame
+        else:
+            frame[1] = i + 1
+            child = children[i]
+            if not child.is_leaf:
+                stack.append([child.children, 0, a, b, INF if mx else NEG_INF, not mx])
+                continue
+            value = child.value
+
+        if mx:
+            if value > best:
+                frame[4] = best = value
+            if best >= b:
+                frame[1] = len(children)  # PRUNE
+            elif best > a:
+                frame[2] = best
+        else:
+            if value < best:
+                frame[4] = best = value
+            if best <= a:
+                frame[1] = len(children)  # PRUNE
+            elif best < b:
+                frame[3] = best
+
+
+def alphabeta_trace(
+    alpha: float, beta: float, node: Node, depth: int, is_max: bool, trace: list[str]
+) -> float:
+    """Alpha-beta search that appends a line to `trace` for every step it takes."""
+    if node.is_leaf:
+        trace.append(indented(depth, f"hit leaf {pnum(node.value)}"))
+        return node.value
+
+    value: float
+
+    trace.append(indented(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]"))
 
     if is_max:
-        value = -math.inf
+        value = NEG_INF
         for child in node.children:
             value = max(
-                value, alphabeta(alpha, beta, child, depth=depth + 1, is_max=False)
+                value,
+                alphabeta_trace(alpha, beta, child, depth + 1, False, trace),
             )
             if value >= beta:
                 # we will never be allowed to get here
-                inprint(
-                    depth,
-                    f"{pname(is_max)}: could force {pnum(value)}? {pname(not is_max)} says {pnum(beta)}; PRUNE",
+                trace.append(
+                    indented(
+                        depth,
+                        f"{pname(is_max)}: could force {pnum(value)}? {pname(not is_max)} says {pnum(beta)}; PRUNE",
+                    )
                 )
                 return value  # value still returned, potentially allowing bigger prunes above!
             alpha = max(alpha, value)  # feed value back into rest of search
-            inprint(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]")
+            trace.append(
+                indented(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]")
+            )
 
-        inprint(depth, f"{pname(is_max)}: can force {pnum(value)}")
+        trace.append(indented(depth, f"{pname(is_max)}: can force {pnum(value)}"))
         return value
 
     else:
-        value = math.inf
+        value = INF
         for child in node.children:
             value = min(
-                value, alphabeta(alpha, beta, child, depth=depth + 1, is_max=True)
+                value,
+                alphabeta_trace(alpha, beta, child, depth + 1, True, trace),
             )
             if value <= alpha:
                 # we will never be allowed to get here
-                inprint(
-                    depth,
-                    f"{pname(is_max)}: could force {pnum(value)}? {pname(not is_max)} says {pnum(alpha)}; PRUNE",
+                trace.append(
+                    indented(
+                        depth,
+                        f"{pname(is_max)}: could force {pnum(value)}? {pname(not is_max)} says {pnum(alpha)}; PRUNE",
+                    )
                 )
                 return value  # value still returned, potentially allowing bigger prunes above!
             beta = min(beta, value)  # feed value back into rest of search
-            inprint(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]")
+            trace.append(
+                indented(depth, f"{pname(is_max)}: [{pnum(alpha)}, {pnum(beta)}]")
+            )
 
-        inprint(depth, f"{pname(is_max)}: can force {pnum(value)}")
+        trace.append(indented(depth, f"{pname(is_max)}: can force {pnum(value)}"))
         return value
 
 
-def ab_start(node: Node, is_max: bool):
-    alphabeta(alpha=-math.inf, beta=math.inf, node=node, depth=0, is_max=is_max)
+def ab_start(node: Node, is_max: bool, trace: list[str] | None = None) -> float:
+    """
+    Runs alpha-beta search from the root of a tree.
+
+    If `trace` is given, every step of the search is appended to it
+    so the caller can print it all at once afterwards.
+    Otherwise trees too deep for the recursion limit are searched with `alphabeta_iter`.
+    """
+    if trace is None:
+        try:
+            return alphabeta_core(alpha=NEG_INF, beta=INF, node=node, is_max=is_max)
+        except RecursionError:
+            return alphabeta_iter(alpha=NEG_INF, beta=INF, node=node, is_max=is_max)
+    return alphabeta_trace(
+        alpha=NEG_INF, beta=INF, node=node, depth=0, is_max=is_max, trace=trace
+    )
@@ -0,0 +1,126 @@
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+from .abprune import Node, _order
+
+
+def flatten(
+    root: Node,
+    is_max: bool | None = None,
+) -> tuple[
+    npt.NDArray[np.float64], npt.NDArray[np.int32], npt.NDArray[np.int32], int
+]:
+    """
+    Flattens a tree into arrays of node values, first child indices and child counts,
+    along with its depth (the most branch nodes on any path from the root).
+
+    Children of each node are given consecutive indices, so the children of node `i`
+    are `first_child[i]` up to `first_child[i] + n_children[i]`. The root is index 0.
+    Leaves have a child count of -1, so that a branch with no children (count 0)
+    is not mistaken for a leaf.
+    Build these once and reuse them, since flattening visits every node.
+
+    If `is_max` says who moves at the root, the children of each node are laid out
+    in move order (see `_order`) rather than insertion order.
+    """
+    values: list[float] = [root.value]
+    first_child: list[int] = [0]
+    n_children: list[int] = [-1]
+    depth = 0
+
+    stack: list[tuple[int, Node, bool, int]] = [(0, root, bool(is_max), 1)]
+    while stack:
+        i, node, mx, d = stack.pop()
+        if node.is_leaf:
+            continue
+        depth = max(depth, d)
+        # allocate all the children in one block so they stay contiguous
+        first_child[i] = len(values)
+        n_children[i] = len(node.children)
+        children = node.children if is_max is None else _order(node, mx)
+        for child in children:
+            stack.append((len(values), child, not mx, d + 1))
+            values.append(child.value)
+            first_child.append(0)
+            n_children.append(-1)
+
+    return (
+        np.array(values, dtype=np.float64),
+        np.array(first_child, dtype=np.int32),
+        np.array(n_children, dtype=np.int32),
+        depth,
+    )
+
+
+@njit(cache=True)
+def alphabeta_nb(
+    values: npt.NDArray[np.float64],
+    first_child: npt.NDArray[np.int32],
+    n_children: npt.NDArray[np.int32],
+    depth: int,
+    node: int,
+    alpha: float,
+    beta: float,
+    is_max: bool,
+) -> float:
+    """
+    Alpha-beta search over a flattened tree (see `flatten`), compiled with Numba.
+
+    Uses an explicit stack of [next child, end of children, alpha, beta, best so far, is_max]
+    frames, held in arrays with room for `depth` frames, as
+    Numba does not cope with recursive functions being loaded from its cache.
+    For callers who already hold the flattened arrays; `ab_start` searches the Node tree.
+    """
+    if n_children[node] < 0:
+        return values[node]
+
+    n = depth
+    s_child = np.empty(n, dtype=np.int32)
+    s_end = np.empty(n, dtype=np.int32)
+    s_alpha = np.empty(n, dtype=np.float64)
+    s_beta = np.empty(n, dtype=np.float64)
+    s_best = np.empty(n, dtype=np.float64)
+    s_max = np.empty(n, dtype=np.bool_)
+
+    top = 0
+    s_child[0] = first_child[node]
+    s_end[0] = first_child[node] + n_children[node]
+    s_alpha[0] = alpha
+    s_beta[0] = beta
+    s_best[0] = -np.inf if is_max else np.inf
+    s_max[0] = is_max
+
+    while True:
+        child = s_child[top]
+        if child == s_end[top]:
+            if top == 0:
+                return s_best[0]
+            value = s_best[top]
+            top -= 1
+        else:
+            s_child[top] = child + 1
+            if n_children[child] >= 0:
+                mx = s_max[top]
+                top += 1
+                s_child[top] = first_child[child]
+                s_end[top] = first_child[child] + n_children[child]
+                s_alpha[top] = s_alpha[top - 1]
+                s_beta[top] = s_beta[top - 1]
+                s_best[top] = np.inf if mx else -np.inf
+                s_max[top] = not mx
+                continue
+            value = values[child]
+
+        if s_max[top]:
+            s_best[top] = max(s_best[top], value)
+            if s_best[top] >= s_beta[top]:
+                s_child[top] = s_end[top]
+            elif s_best[top] > s_alpha[top]:
+                s_alpha[top] = s_best[top]
+        else:
+            s_best[top] = min(s_best[top], value)
+            if s_best[top] <= s_alpha[top]:
+                s_child[top] = s_end[top]
+            elif s_best[top] < s_beta[top]:
+                s_beta[top] = s_best[top]
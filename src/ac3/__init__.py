@@ -46,4 +46,4 @@ def main() -> None:
         assignments={}
     )
 
-    backtrack(csp, forced_order, forced_attempts)
\ No newline at end of file
+    backtrack(csp, forced_order, forced_attempts, verbose=True)
\ No newline at end of file
@@ -1,10 +1,13 @@
+from collections.abc import Iterator
+from itertools import chain
 from .csp import CSP
 from .utils import inprint
 
 def backtrack[V, T](
         csp: CSP[V, T],
         forced_order: list[V] | None = None,
-        forced_attempts: dict[V, T] | None = None
+        forced_attempts: dict[V, T] | None = None,
+        verbose: bool = False
 ) -> dict[V, T] | None:
     """
     Backtracking algorithm for solving a CSP.
@@ -12,39 +15,45 @@ def backtrack[V, T](
     Specify `forced_order` and `forced_attempts` to guide the
     order of variable assignment and values to try respectively.
 
+    Set `verbose` to print the assignments and domains at every step.
+
     Returns a set of satisfying assignments, or `None` if none exists.
     """
     depth = len(csp.assignments)
-    if depth == 0:
+    if verbose and depth == 0:
         inprint(depth=depth, text=csp.str_of_assignments())
         inprint(depth=depth, text=csp.str_of_domains())
         print()
 
     if len(csp.assignments) == len(csp.variables):
-        return csp.assignments
+        # copy, since the assignments get undone on the way back up
+        return csp.assignments.copy()
     
     if forced_order is not None and len(forced_order) > depth:
         next_var = forced_order[depth]
     else:
         next_var = csp.get_next_variable()
     
-    value_order = csp.get_value_order(next_var)
+    value_order: Iterator[T] = csp.get_value_order(next_var)
     if forced_attempts is not None and next_var in forced_attempts:
         attempt = forced_attempts[next_var]
-        if attempt in value_order:
-            value_order.remove(attempt)
-            value_order.insert(0, attempt)
+        if attempt in csp.get_domain(next_var):
+            value_order = chain((attempt,), (t for t in value_order if t != attempt))
 
     for t in value_order:
-        child_csp = CSP.copy_of(csp)
-        is_consistent = child_csp.add_assignment(next_var, t)
-        inprint(depth=depth+1, text=child_csp.str_of_assignments())
-        inprint(depth=depth+1, text=child_csp.str_of_domains())
-        print()
-        if not is_consistent:
-            continue
+        # try the assignment in place, and undo it afterwards
+        csp.push_frame()
+        is_consistent = csp.add_assignment(next_var, t)
+        if verbose:
+            inprint(depth=depth+1, text=csp.str_of_assignments())
+            inprint(depth=depth+1, text=csp.str_of_domains())
+            print()
+
+        solution: dict[V, T] | None = None
+        if is_consistent:
+            solution = backtrack(csp, forced_order, forced_attempts, verbose)
+        csp.pop_frame()
 
-        solution: dict[V, T] | None = backtrack(child_csp, forced_order, forced_attempts)
         if solution is not None:
             return solution
     
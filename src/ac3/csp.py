@@ -1,25 +1,134 @@
-from typing import Self
-from dataclasses import dataclass
+from typing import TYPE_CHECKING, Self
+from dataclasses import dataclass, field
+import copy
 from collections import deque
+from collections.abc import Iterator
+import heapq
 
+if TYPE_CHECKING:
+    from .encoded import EncodedCSP
 
-@dataclass
+
+@dataclass(init=False)
 class CSP[V, T]:
     """
     Represents a constraint satisfaction problem, including variable assignments.
 
-    This is mutable; a backtracking algorithm should make child copies with copy_of().
+    This is mutable; a backtracking algorithm should either make child copies with copy_of(),
+    or wrap each attempt in push_frame() and pop_frame() to undo it in place.
+
+    Domains are given as sets, but stored in `domains` as bitmasks over every value
+    that appears in any domain; use get_domain() to get one back as a set.
     """
 
     variables: set[V]
-    domains: dict[V, set[T]]
+    domains: dict[V, int]
     constraints: dict[tuple[V, V], set[tuple[T, T]]]
     assignments: dict[V, T]
 
+    _unassigned: set[V] = field(repr=False, compare=False)
+
+    # one frame per push_frame(): the domains as they were before being changed
+    # in that frame, and the variables assigned in it
+    _trail: list[tuple[dict[V, int], list[V]]] = field(repr=False, compare=False)
+
+    # derived from the domains and constraints given at construction,
+    # which never change during search, so copies share these by reference
+    _bit: dict[T, int] = field(repr=False, compare=False)
+    _val: dict[int, T] = field(repr=False, compare=False)
+    _neighbours: dict[V, frozenset[V]] = field(repr=False, compare=False)
+    _cons: dict[tuple[V, V], frozenset[tuple[T, T]]] = field(repr=False, compare=False)
+    _supports: dict[tuple[V, V], dict[int, int]] = field(repr=False, compare=False)
+    _arcs_into: dict[V, list[tuple[V, V, dict[int, int]]]] = field(repr=False, compare=False)
+
+
+    def __init__(
+        self,
+        variables: set[V],
+        domains: dict[V, set[T]],
+        constraints: dict[tuple[V, V], set[tuple[T, T]]],
+        assignments: dict[V, T]
+    ):
+        self.variables = variables
+        self.constraints = constraints
+        self.assignments = assignments
+        self._trail = []
+
+        # give every value that can appear anywhere its own bit
+        self._bit = {}
+        for ts in domains.values():
+            for t in ts:
+                if t not in self._bit:
+                    self._bit[t] = 1 << len(self._bit)
+        self._val = {b: t for t, b in self._bit.items()}
+        self.domains = {v: self._mask_of(ts) for v, ts in domains.items()}
+        self._unassigned = self.variables - self.assignments.keys()
+
+        neighbours: dict[V, set[V]] = {v: set() for v in self.variables}
+        for (a, b) in self.constraints:
+            neighbours.setdefault(a, set()).add(b)
+            neighbours.setdefault(b, set()).add(a)
+        self._neighbours = {v: frozenset(ns) for v, ns in neighbours.items()}
+
+        # constraints indexed in both directions, with values swapped for the reverse
+        cons: dict[tuple[V, V], frozenset[tuple[T, T]]] = {}
+        pairs: frozenset[tuple[T, T]]
+        for (i, j), cs in self.constraints.items():
+            for key, pairs in (
+                ((i, j), frozenset(cs)),
+                ((j, i), frozenset((t_j, t_i) for (t_i, t_j) in cs))
+            ):
+                # if both orders were given, both have to hold
+                cons[key] = cons[key] & pairs if key in cons else pairs
+        self._cons = cons
+
+        # for each directed constraint, a mask of the values of j allowed by each value of i
+        supports: dict[tuple[V, V], dict[int, int]] = {}
+        for (i, j), pairs in cons.items():
+            masks_j: dict[int, int] = {b: 0 for b in self._bits_of(self.domains.get(i, 0))}
+            for (t_i, t_j) in pairs:
+                if t_i in self._bit and t_j in self._bit:
+                    b_i = self._bit[t_i]
+                    masks_j[b_i] = masks_j.get(b_i, 0) | self._bit[t_j]
+            supports[(i, j)] = masks_j
+        self._supports = supports
+
+        # the queue entries AC-3 needs when a variable's domain shrinks, ready made
+        arcs_into: dict[V, list[tuple[V, V, dict[int, int]]]] = {v: [] for v in self._neighbours}
+        for (k, i), supports_ki in supports.items():
+            arcs_into[i].append((k, i, supports_ki))
+        self._arcs_into = arcs_into
+
+
+    def _mask_of(self, ts) -> int:
+        """Bitmask of a collection of values."""
+        mask = 0
+        for t in ts:
+            mask |= self._bit[t]
+        return mask
+
+
+    @staticmethod
+    def _bits_of(mask: int) -> Iterator[int]:
+        """Iterates over the set bits of a bitmask, lowest first."""
+        while mask:
+            bit = mask & -mask
+            yield bit
+            mask ^= bit
+
+
+    def get_domain(self, variable: V) -> set[T]:
+        """Gets the values still possible for a variable."""
+        return {self._val[b] for b in self._bits_of(self.domains[variable])}
+
 
     def str_of_domains(self):
         """Returns compact string representation of domains."""
-        return " ".join(f"{v}({"".join(ts)})" for v, ts in self.domains.items())
+        # sorted so the output doesn't depend on the order values were first seen in
+        return " ".join(
+            f"{v}({"".join(sorted(self._val[b] for b in self._bits_of(mask)))})"
+            for v, mask in self.domains.items()
+        )
 
 
     def str_of_assignments(self):
@@ -41,7 +150,7 @@ class CSP[V, T]:
             if i not in self.variables or j not in self.variables:
                 return False
             for (t_i, t_j) in cs:
-                if t_i not in self.domains[i] or t_j not in self.domains[j]:
+                if not self._bit.get(t_i, 0) & self.domains[i] or not self._bit.get(t_j, 0) & self.domains[j]:
                     return False
         
         return True
@@ -52,46 +161,98 @@ class CSP[V, T]:
         """
         Returns a copy of a CSP; to be used in backtracking algorithms.
         """
-        # make sure to make copies of the sets within domains!
-        # TODO: do we also need to deep copy constraints or not?
-        # doesn't seem like we ever change them...
-        return cls(
-            variables=other.variables,
-            domains={k: v.copy() for k, v in other.domains.items()},
-            constraints=other.constraints,
-            assignments=other.assignments.copy()
+        # domains are plain ints, so a shallow copy of the dict is enough
+        # constraints (and everything derived from them) never change, so they are shared
+        new = copy.copy(other)
+        new.domains = other.domains.copy()
+        new.assignments = other.assignments.copy()
+        new._unassigned = other._unassigned.copy()
+        new._trail = []
+        return new
+
+
+    def encode(self) -> "EncodedCSP[V, T]":
+        """
+        Returns the current state of a CSP as integer arrays, for the compiled AC-3 kernel.
+
+        Only works with up to 64 distinct values, as each domain has to fit in a uint64.
+        """
+        # only needed here, so plain CSP users don't pay for importing numba
+        import numpy as np
+
+        from .encoded import EncodedCSP
+
+        n_vals = len(self._bit)
+        if n_vals > 64:
+            raise ValueError(f"can only encode up to 64 distinct values, not {n_vals}")
+
+        variables = list(self.domains)
+        index = {v: i for i, v in enumerate(variables)}
+
+        # arcs grouped by the variable they come from
+        arcs = [(i, j) for i in variables for j in self._neighbours.get(i, ())]
+        arc_index = {arc: p for p, arc in enumerate(arcs)}
+        adj_offsets = np.zeros(len(variables) + 1, dtype=np.int32)
+        for (i, _) in arcs:
+            adj_offsets[index[i] + 1] += 1
+
+        supports = np.zeros((len(arcs), max(n_vals, 1)), dtype=np.uint64)
+        for p, arc in enumerate(arcs):
+            for bit, mask in self._supports[arc].items():
+                supports[p, bit.bit_length() - 1] = mask
+
+        return EncodedCSP(
+            variables=variables,
+            values=[self._val[1 << b] for b in range(n_vals)],
+            domains=np.array([self.domains[v] for v in variables], dtype=np.uint64),
+            supports=supports,
+            adj_offsets=np.cumsum(adj_offsets, dtype=np.int32),
+            adj_indices=np.array([index[j] for (_, j) in arcs], dtype=np.int32),
+            reverse=np.array([arc_index[(j, i)] for (i, j) in arcs], dtype=np.int32),
+            assignments=self.assignments.copy()
         )
+
+
+    def push_frame(self):
+        """Starts recording changes, so they can be undone by the next pop_frame()."""
+        self._trail.append(({}, []))
+
+
+    def pop_frame(self):
+        """Undoes every assignment and domain change since the matching push_frame()."""
+        saved, assigned = self._trail.pop()
+        self.domains.update(saved)
+        for v in assigned:
+            del self.assignments[v]
+        self._unassigned.update(assigned)
+
+
+    def _set_domain(self, variable: V, mask: int):
+        """Changes a domain, saving the old one in the current frame if it's the first change there."""
+        if self._trail:
+            saved = self._trail[-1][0]
+            if variable not in saved:
+                saved[variable] = self.domains[variable]
+        self.domains[variable] = mask
     
 
-    def get_neighbours(self, variable: V) -> set[V]:
+    def get_neighbours(self, variable: V) -> frozenset[V]:
         """Gets the constraint neighbours of a variable."""
-        neighbours: set[V] = set()
-        for (a, b) in self.constraints:
-            if variable == a:
-                neighbours.add(b)
-            if variable == b:
-                neighbours.add(a)
-        return neighbours
+        return self._neighbours[variable]
     
 
-    def get_constraints(self, i: V, j: V) -> set[tuple[T, T]] | None:
+    def get_constraints(self, i: V, j: V) -> frozenset[tuple[T, T]] | None:
         """
-        Gets (a copy of) the allowable set of values in the constraint
+        Gets the allowable set of values in the constraint
         between a directed variable pair, if one exists.
         """
-        # check both tuple orders!
-        if (i, j) in self.constraints:
-            return self.constraints[(i, j)]
-        elif (j, i) in self.constraints:
-            return set((t_i, t_j) for (t_j, t_i) in self.constraints[(j, i)])
-        else:
-            return None
+        return self._cons.get((i, j))
 
 
     def get_remaining_value_counts(self) -> dict[V, int]:
         """Gets the number of remaining possible assignments for all variables."""
         # assumes that forward checking of some form is in place
-        return {v: len(dom) for v, dom in self.domains.items()}
+        return {v: mask.bit_count() for v, mask in self.domains.items()}
     
 
     def get_degrees(self) -> dict[V, int]:
@@ -116,20 +277,29 @@ class CSP[V, T]:
         Applies the minimum remaining values heuristic first,
         then uses degree as a tiebreaker.
         """
-        candidates: set[V] = set(v for v in self.variables if v not in self.assignments)
-        
-        rvcs = self.get_remaining_value_counts()
-        min_rvc = min(rvcs[v] for v in candidates)
-        candidates = set(v for v in candidates if rvcs[v] == min_rvc)
-        if len(candidates) == 1:
-            return candidates.pop()
-        
-        degrees = self.get_degrees()
-        max_degree = max(degrees[v] for v in candidates)
-        candidates = set(v for v in candidates if degrees[v] == max_degree)
-        
-        # even if more than one candidate remains, we just have to return one at this point
-        return candidates.pop()
+        unassigned = self._unassigned
+        if len(unassigned) == 1:
+            # nothing to compare, so skip working out any heuristics
+            return next(iter(unassigned))
+
+        # one pass over the unassigned variables, keeping the best so far
+        domains = self.domains
+        neighbours = self._neighbours
+        best: V | None = None
+        best_rvc = 0
+        best_degree = 0
+        for v in unassigned:
+            rvc = domains[v].bit_count()
+            if best is not None and rvc > best_rvc:
+                continue
+            # degree only counts constraints with other unassigned variables
+            degree = len(neighbours[v] & unassigned)
+            if best is None or rvc < best_rvc or degree > best_degree:
+                best, best_rvc, best_degree = v, rvc, degree
+
+        # if there are still ties at this point, we just have to return one of them
+        assert best is not None
+        return best
     
 
     def get_option_count_per_assignment(self, variable: V) -> dict[T, int]:
@@ -138,27 +308,26 @@ class CSP[V, T]:
         allowed by each possible assignment to a variable.
         """
         # checks for neighbours' domains might not be strictly necessary for LCV?
-        counts: dict[T, int] = {t: 0 for t in self.domains[variable]}
-        for (v_l, v_r), cs in self.constraints.items():
-            if variable == v_l:
-                for (t_l, t_r) in cs:
-                    if t_l in counts and t_r in self.domains[v_r]:
-                        counts[t_l] += 1
-            elif variable == v_r:
-                for (t_l, t_r) in cs:
-                    if t_r in counts and t_l in self.domains[v_l]:
-                        counts[t_r] += 1
+        arcs = [(self._supports[(variable, n)], self.domains[n]) for n in self._neighbours[variable]]
+        counts: dict[T, int] = {}
+        for b in self._bits_of(self.domains[variable]):
+            counts[self._val[b]] = sum((supports[b] & domain).bit_count() for supports, domain in arcs)
         return counts
     
 
-    def get_value_order(self, variable: V):
+    def get_value_order(self, variable: V) -> Iterator[T]:
         """
         Heuristic for the order in which values for a variable should be tried.
 
         Uses the least constraining value heuristic.
+        Values are produced lazily, since backtracking often stops at the first one.
         """
         option_counts: dict[T, int] = self.get_option_count_per_assignment(variable)
-        return sorted(option_counts, key=lambda t: option_counts[t], reverse=True)
+        # heapify is linear, and then each value costs a log only if it gets tried;
+        # the index breaks ties in the original order and saves comparing values
+        heap = [(-count, k, t) for k, (t, count) in enumerate(option_counts.items())]
+        heapq.heapify(heap)
+        return (heapq.heappop(heap)[2] for _ in range(len(heap)))
     
 
     def add_assignment(self, variable: V, value: T) -> bool:
@@ -169,54 +338,81 @@ class CSP[V, T]:
         """
         assert variable in self.variables
         assert variable not in self.assignments
-        assert value in self.domains[variable]
+        assert self._bit.get(value, 0) & self.domains[variable]
 
+        # the first assignment has to make everything arc consistent;
+        # after that only arcs into the newly assigned variable can have changed
+        is_first = not self.assignments
         self.assignments[variable] = value
-        self.domains[variable] = set((value,))
-        return self.ac_3()
+        self._unassigned.discard(variable)
+        if self._trail:
+            self._trail[-1][1].append(variable)
+        self._set_domain(variable, self._bit[value])
+        if is_first:
+            return self.ac_3_full()
+        return self.ac_3_incremental(variable)
     
 
-    def ac_3(self) -> bool:
+    def ac_3_full(self) -> bool:
+        """
+        AC-3 algorithm for constraint propagation in a CSP, starting from every arc.
+
+        Return value indicates whether the CSP is still consistent.
+        """
+        # between them, the arcs into each variable cover every arc in both directions
+        return self._ac_3(deque(arc for arcs in self._arcs_into.values() for arc in arcs))
+
+
+    def ac_3_incremental(self, changed: V) -> bool:
         """
-        AC-3 algorithm for constraint propagation in a CSP.
+        AC-3 algorithm for constraint propagation after the domain of one variable
+        has shrunk, starting from only the arcs pointing at it.
 
+        Only valid if the CSP was arc consistent before that change.
         Return value indicates whether the CSP is still consistent.
         """
-        to_check: deque[tuple[V, V]] = deque()
+        return self._ac_3(deque(self._arcs_into[changed]))
+
 
-        # add arcs in both directions
-        to_check.extend((i, j) for (i, j) in self.constraints)
-        to_check.extend((j, i) for (i, j) in self.constraints)
+    def _ac_3(self, to_check: deque[tuple[V, V, dict[int, int]]]) -> bool:
+        """
+        Main loop of AC-3, working through a queue of arcs to check.
 
+        Each arc comes with its supports, so revising it needs no lookups.
+        """
+        arcs_into = self._arcs_into
         while to_check:
-            (i, j) = to_check.popleft()
-            if self.remove_inconsistencies(i, j):
+            (i, j, supports_ij) = to_check.popleft()
+            if self.remove_inconsistencies(i, j, supports_ij):
                 if not self.domains[i]:
                     return False
-                for k in self.get_neighbours(i):
-                    if k != j:
-                        to_check.append((k, i))
+                for arc in arcs_into[i]:
+                    if arc[0] != j:
+                        to_check.append(arc)
         
         return True
                 
 
-    def remove_inconsistencies(self, i: V, j: V) -> bool:
+    def remove_inconsistencies(self, i: V, j: V, supports_ij: dict[int, int]) -> bool:
         """
-        Removes inconsistent domain elements from the origin of a directed constraint.
+        Removes inconsistent domain elements from the origin of a directed constraint,
+        given as the supports of the arc from i to j.
 
         Return value denotes whether any domain elements were removed.
         """
-        result = False
-        constraint_ij = self.get_constraints(i, j)
-        assert constraint_ij is not None  # lmao
-
-        new_i_domain: set[T] = set()
-        for t_i in self.domains[i]:
-            ts_j = set(t_b for (t_a, t_b) in constraint_ij if t_a == t_i and t_b in self.domains[j])
-            if not ts_j:
-                result = True
-            else:
-                new_i_domain.add(t_i)
-        
-        self.domains[i] = new_i_domain
-        return result
\ No newline at end of file
+        domain_j = self.domains[j]
+
+        # keep the values of i which still have some value of j to go with them
+        domain_i = self.domains[i]
+        new_i_domain = 0
+        rest = domain_i
+        while rest:
+            bit = rest & -rest
+            rest ^= bit
+            if supports_ij[bit] & domain_j:
+                new_i_domain |= bit
+
+        if new_i_domain == domain_i:
+            return False
+        self._set_domain(i, new_i_domain)
+        return True
\ No newline at end of file
@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+from numba import njit
+
+
+@njit(cache=True)
+def ac3_nb(
+    domains: npt.NDArray[np.uint64],
+    supports: npt.NDArray[np.uint64],
+    adj_offsets: npt.NDArray[np.int32],
+    adj_indices: npt.NDArray[np.int32],
+    reverse: npt.NDArray[np.int32],
+    start_var: int
+) -> bool:
+    """
+    AC-3 over an encoded CSP (see `EncodedCSP`), compiled with Numba.
+
+    Starts from the arcs pointing at `start_var`, or from every arc if it is -1.
+    Domains are narrowed in place; return value indicates whether the CSP is still consistent.
+    """
+    n_arcs = adj_indices.shape[0]
+    n_vals = supports.shape[1]
+    if n_arcs == 0:
+        return True
+
+    bits = np.empty(n_vals, dtype=np.uint64)
+    for b in range(n_vals):
+        bits[b] = np.uint64(1) << np.uint64(b)
+
+    # ring buffer of arcs to check; each arc is in it at most once
+    queue = np.empty(n_arcs, dtype=np.int32)
+    in_queue = np.zeros(n_arcs, dtype=np.bool_)
+    head = 0
+    size = 0
+
+    if start_var < 0:
+        for p in range(n_arcs):
+            queue[p] = p
+            in_queue[p] = True
+        size = n_arcs
+    else:
+        for q in range(adj_offsets[start_var], adj_offsets[start_var + 1]):
+            p = reverse[q]
+            queue[size] = p
+            in_queue[p] = True
+            size += 1
+
+    while size > 0:
+        p = queue[head]
+        head = (head + 1) % n_arcs
+        size -= 1
+        in_queue[p] = False
+
+        # arc p goes from i to j; its reverse goes from j to i
+        j = adj_indices[p]
+        i = adj_indices[reverse[p]]
+        domain_i = domains[i]
+        domain_j = domains[j]
+
+        new_i_domain = np.uint64(0)
+        for b in range(n_vals):
+            if domain_i & bits[b] and supports[p, b] & domain_j:
+                new_i_domain |= bits[b]
+
+        if new_i_domain == domain_i:
+            continue
+        domains[i] = new_i_domain
+        if new_i_domain == 0:
+            return False
+
+        for q in range(adj_offsets[i], adj_offsets[i + 1]):
+            r = reverse[q]  # arc from a neighbour k back to i
+            if adj_indices[q] != j and not in_queue[r]:
+                queue[(head + size) % n_arcs] = r
+                in_queue[r] = True
+                size += 1
+
+    return True
+
+
+@dataclass
+class EncodedCSP[V, T]:
+    """
+    A CSP flattened into integer arrays for `ac3_nb`; made with CSP.encode().
+
+    Variable `variables[i]` has its domain in `domains[i]` as a bitmask over `values`.
+    The arcs out of variable i are `adj_offsets[i]` up to `adj_offsets[i + 1]`:
+    arc p goes to variable `adj_indices[p]`, `reverse[p]` is the arc going back,
+    and `supports[p, b]` is a mask of the values of the target allowed by value b of the source.
+    """
+
+    variables: list[V]
+    values: list[T]
+    domains: npt.NDArray[np.uint64]
+    supports: npt.NDArray[np.uint64]
+    adj_offsets: npt.NDArray[np.int32]
+    adj_indices: npt.NDArray[np.int32]
+    reverse: npt.NDArray[np.int32]
+    assignments: dict[V, T]
+
+
+    def __post_init__(self):
+        self._index = {v: i for i, v in enumerate(self.variables)}
+        self._value_index = {t: b for b, t in enumerate(self.values)}
+
+
+    def get_domain(self, variable: V) -> set[T]:
+        """Gets the values still possible for a variable."""
+        mask = int(self.domains[self._index[variable]])
+        return {t for b, t in enumerate(self.values) if mask >> b & 1}
+
+
+    def add_assignment(self, variable: V, value: T) -> bool:
+        """
+        Adds an assignment, running the compiled AC-3 kernel for constraint propagation.
+
+        Return value indicates whether the CSP is still consistent.
+        """
+        i = self._index[variable]
+        bit = np.uint64(1 << self._value_index[value])
+        assert variable not in self.assignments
+        assert self.domains[i] & bit
+
+        # as in CSP.add_assignment, only the first assignment needs every arc checked
+        start_var = -1 if not self.assignments else i
+        self.assignments[variable] = value
+        self.domains[i] = bit
+        return ac3_nb(
+            self.domains, self.supports, self.adj_offsets, self.adj_indices, self.reverse, start_var
+        )